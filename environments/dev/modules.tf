@@ -131,6 +131,40 @@ module "lambda_upload" {
   tags = var.tags
 }
 
+module "lambda_replay" {
+  source = "./../../modules/lambda_replay"
+
+  project_name = var.project_name
+  env          = var.env
+
+  s3_bucket_name = module.s3.bucket_id
+
+  vpc_id     = module.vpc.vpc_id
+  subnet_ids = module.vpc.private_subnets
+
+  kms_key_arn = module.security.kms_key_arn
+
+  # Main EventBridge DLQ plus every model DLQ
+  dlq_arns = module.sqs.all_dlq_arns
+
+  # Model DLQs are redriven straight into the queue they drain
+  replay_queue_map = {
+    for model, dlq in module.sqs.model_dlqs :
+    dlq.url => module.sqs.model_queues[model].url
+  }
+  replay_queue_arns = [for queue in module.sqs.model_queues : queue.arn]
+
+  # Only these detail-types reach a model queue when published to EventBridge
+  routed_detail_types = module.eventbridge.processing_detail_types
+
+  aurora_cluster_arn   = module.aurora.cluster_arn
+  aurora_secret_arn    = module.aurora.secret_arn
+  aurora_database_name = module.aurora.database_name
+  aurora_kms_key_arn   = module.aurora.kms_key_arn
+
+  tags = var.tags
+}
+
 module "lambda_processors" {
   source = "./../../modules/lambda_processors"
 
@@ -49,6 +49,11 @@ output "lambda_upload_function_arn" {
   value       = module.lambda_upload.function_arn
 }
 
+output "lambda_replay_function_name" {
+  description = "Name of the DLQ replay Lambda function"
+  value       = module.lambda_replay.function_name
+}
+
 # Security outputs
 output "kms_key_arn" {
   description = "ARN of the KMS key for encryption"
@@ -21,4 +21,9 @@ output "processing_rule_names" {
 output "event_bus_rule_arns" {
   description = "Temporary empty list while rules are being recreated"
   value       = []
-}
\ No newline at end of file
+}
+
+output "processing_detail_types" {
+  description = "Map of processing rule names to the event detail-type each routes to a model queue"
+  value       = local.processors
+}
@@ -0,0 +1,541 @@
+import json
+import uuid
+import time
+import os
+import threading
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Set
+from urllib.parse import urlparse
+from botocore.exceptions import BotoCoreError, ClientError
+from botocore.config import Config
+import logging
+
+# Configure logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Configure AWS clients - pool sized for the worker threads sharing them
+config = Config(
+    retries = dict(
+        max_attempts = 3
+    ),
+    max_pool_connections = 50
+)
+
+# EventBridge and SQS both cap batch calls at 10 entries
+MAX_BATCH_SIZE = 10
+# Stop picking up new work when less than this much Lambda time is left
+TIME_MARGIN_MS = 30000
+# Errors treated as per-batch failures rather than failing the whole run
+AWS_ERRORS = (ClientError, BotoCoreError)
+
+DEFAULTS = {
+    'rate_per_second': 10.0,
+    'concurrency': 4,
+    'max_messages': 0,  # 0 means drain until empty / out of time
+    'page_size': 500,
+    'start_after_id': 0,
+    'dry_run': False,
+}
+
+
+class RateLimiter:
+    """Thread-safe token bucket limiting events published per second."""
+
+    def __init__(self, rate_per_second: float):
+        self.rate = float(rate_per_second)
+        self.capacity = max(self.rate, float(MAX_BATCH_SIZE))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count: int = 1) -> None:
+        """Block until `count` tokens are available."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ReplayHandler:
+    def __init__(self):
+        self.sqs_client = boto3.client('sqs', config=config)
+        self.eventbridge_client = boto3.client('events', config=config)
+        self.rds_client = boto3.client('rds-data', config=config)
+        # Detail-types that have an EventBridge rule routing them to a model queue
+        self.routed_detail_types = set(json.loads(os.environ.get('ROUTED_DETAIL_TYPES', '[]')))
+        # Model DLQ URL -> URL of the queue it drains, for direct redrive
+        self.replay_queue_map = json.loads(os.environ.get('REPLAY_QUEUE_MAP', '{}'))
+
+    def parse_options(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge invocation payload with defaults and normalise filters."""
+        options = {**DEFAULTS, **{k: v for k, v in event.items() if v is not None}}
+        options['mode'] = event.get('mode', 'dlq')
+        options['rate_per_second'] = float(options['rate_per_second'])
+        options['concurrency'] = max(1, int(options['concurrency']))
+        options['max_messages'] = int(options['max_messages'])
+        options['page_size'] = max(1, int(options['page_size']))
+        options['start_after_id'] = int(options['start_after_id'])
+        options['company_ids'] = self.to_int_set(event.get('company_ids'))
+        options['photo_ids'] = self.to_int_set(event.get('photo_ids'))
+        options['models'] = set(self.to_list(event.get('models')))
+        return options
+
+    @staticmethod
+    def to_list(values: Any) -> List[Any]:
+        """Accept a list, a single value, or a comma separated string like the upload `models` header."""
+        if values is None or values == '':
+            return []
+        if isinstance(values, str):
+            return [v.strip() for v in values.split(',') if v.strip()]
+        if isinstance(values, (list, tuple, set)):
+            return list(values)
+        return [values]
+
+    def to_int_set(self, values: Any) -> Optional[Set[int]]:
+        values = self.to_list(values)
+        if not values:
+            return None
+        try:
+            return {int(v) for v in values}
+        except (TypeError, ValueError):
+            raise ValueError(f"Expected integer ids, got {values}")
+
+    @staticmethod
+    def out_of_time(context: Any) -> bool:
+        return context is not None and context.get_remaining_time_in_millis() < TIME_MARGIN_MS
+
+    def build_event(self, detail_type: str, detail: Dict[str, Any]) -> Dict[str, Any]:
+        """Build an EventBridge entry matching those sent by image upload."""
+        return {
+            'Source': 'custom.imageUpload',
+            'DetailType': detail_type,
+            'Detail': json.dumps(detail),
+            'EventBusName': 'default'
+        }
+
+    def publish_events(self, entries: List[Dict[str, Any]], limiter: RateLimiter, dry_run: bool) -> List[bool]:
+        """Publish up to 10 entries, returning per-entry success."""
+        if not entries:
+            return []
+        if dry_run:
+            return [True] * len(entries)
+        limiter.acquire(len(entries))
+        try:
+            response = self.eventbridge_client.put_events(Entries=entries)
+        except AWS_ERRORS as e:
+            logger.error(f"Error sending events to EventBridge: {str(e)}")
+            return [False] * len(entries)
+        results = []
+        for result in response.get('Entries', []):
+            if 'ErrorCode' in result:
+                logger.error(f"EventBridge rejected entry: {result.get('ErrorCode')} {result.get('ErrorMessage')}")
+                results.append(False)
+            else:
+                results.append(True)
+        return results
+
+    def send_to_queue(self, queue_url: str, bodies: List[str], limiter: RateLimiter, dry_run: bool) -> List[bool]:
+        """Send up to 10 original message bodies back to a model queue, returning per-entry success."""
+        if not bodies:
+            return []
+        if dry_run:
+            return [True] * len(bodies)
+        limiter.acquire(len(bodies))
+        try:
+            response = self.sqs_client.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': str(i), 'MessageBody': body} for i, body in enumerate(bodies)]
+            )
+        except AWS_ERRORS as e:
+            logger.error(f"Error sending messages to {queue_url}: {str(e)}")
+            return [False] * len(bodies)
+        for failure in response.get('Failed', []):
+            logger.error(f"SQS rejected message: {failure.get('Code')} {failure.get('Message')}")
+        successful = {entry['Id'] for entry in response.get('Successful', [])}
+        return [str(i) in successful for i in range(len(bodies))]
+
+    def release_messages(self, queue_url: str, receipt_handles: List[str]) -> None:
+        """Make messages this run did not replay visible in the DLQ again."""
+        for i in range(0, len(receipt_handles), MAX_BATCH_SIZE):
+            chunk = receipt_handles[i:i + MAX_BATCH_SIZE]
+            try:
+                self.sqs_client.change_message_visibility_batch(
+                    QueueUrl=queue_url,
+                    Entries=[
+                        {'Id': str(j), 'ReceiptHandle': handle, 'VisibilityTimeout': 0}
+                        for j, handle in enumerate(chunk)
+                    ]
+                )
+            except AWS_ERRORS as e:
+                logger.error(f"Error releasing {len(chunk)} messages on {queue_url}: {str(e)}")
+
+    def lookup_photo_companies(self, photo_ids: List[int]) -> Optional[Dict[int, int]]:
+        """Resolve company_id for a batch of photos with a single query, or None on error."""
+        if not photo_ids:
+            return {}
+        placeholders = ', '.join(f":p{i}" for i in range(len(photo_ids)))
+        try:
+            response = self.rds_client.execute_statement(
+                resourceArn=os.environ['DB_CLUSTER_ARN'],
+                secretArn=os.environ['DB_SECRET_ARN'],
+                database=os.environ['DB_NAME'],
+                sql=f'SELECT id, company_id FROM photos WHERE id IN ({placeholders})',
+                parameters=[
+                    {'name': f"p{i}", 'value': {'longValue': photo_id}}
+                    for i, photo_id in enumerate(photo_ids)
+                ]
+            )
+        except AWS_ERRORS as e:
+            logger.error(f"Error looking up companies for photos {photo_ids}: {str(e)}")
+            return None
+        return {
+            record[0]['longValue']: record[1].get('longValue')
+            for record in response.get('records', [])
+        }
+
+    def fetch_photo_page(
+            self,
+            after_id: int,
+            page_size: int,
+            company_ids: Optional[Set[int]],
+            photo_ids: Optional[Set[int]],
+    ) -> List[Dict[str, Any]]:
+        """Keyset-paginate the photos table so each page is a cheap index range scan."""
+        sql = 'SELECT id, company_id, photo_s3_link FROM photos WHERE id > :after_id'
+        parameters = [
+            {'name': 'after_id', 'value': {'longValue': after_id}},
+            {'name': 'page_size', 'value': {'longValue': page_size}},
+        ]
+        if company_ids:
+            placeholders = ', '.join(f":c{i}" for i in range(len(company_ids)))
+            sql += f' AND company_id IN ({placeholders})'
+            parameters += [
+                {'name': f"c{i}", 'value': {'longValue': company_id}}
+                for i, company_id in enumerate(sorted(company_ids))
+            ]
+        if photo_ids:
+            placeholders = ', '.join(f":i{i}" for i in range(len(photo_ids)))
+            sql += f' AND id IN ({placeholders})'
+            parameters += [
+                {'name': f"i{i}", 'value': {'longValue': photo_id}}
+                for i, photo_id in enumerate(sorted(photo_ids))
+            ]
+        sql += ' ORDER BY id LIMIT :page_size'
+        response = self.rds_client.execute_statement(
+            resourceArn=os.environ['DB_CLUSTER_ARN'],
+            secretArn=os.environ['DB_SECRET_ARN'],
+            database=os.environ['DB_NAME'],
+            sql=sql,
+            parameters=parameters
+        )
+        return [
+            {
+                'id': record[0]['longValue'],
+                'company_id': record[1].get('longValue'),
+                'photo_s3_link': record[2].get('stringValue'),
+            }
+            for record in response.get('records', [])
+        ]
+
+    def parse_dlq_message(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Extract detail-type and detail from a model queue or EventBridge DLQ message."""
+        try:
+            body = json.loads(message['Body'])
+            detail = body.get('detail')
+            if isinstance(detail, str):
+                detail = json.loads(detail)
+            detail_type = body.get('detail-type')
+            if not detail_type or not isinstance(detail, dict):
+                return None
+            model = detail.get('processingType') or detail_type.replace('_processing', '')
+            return {'detail_type': detail_type, 'detail': detail, 'model': model}
+        except (ValueError, KeyError, AttributeError) as e:
+            logger.error(f"Unable to parse DLQ message {message.get('MessageId')}: {str(e)}")
+            return None
+
+    def replay_dlq(self, options: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        """
+        Stream messages out of a DLQ and replay them.
+
+        Model DLQs are redriven straight into the queue they drain; any other
+        DLQ is re-published through EventBridge, and only for detail-types that
+        a rule routes, since EventBridge accepts events that match no rule.
+        """
+        queue_url = options.get('dlq_url')
+        if not queue_url:
+            raise ValueError("dlq_url is required for dlq mode")
+        target_queue_url = self.replay_queue_map.get(queue_url)
+
+        limiter = RateLimiter(options['rate_per_second'])
+        max_messages = options['max_messages']
+        visibility_timeout = int(os.environ.get('REPLAY_VISIBILITY_TIMEOUT', '900'))
+        lock = threading.Lock()
+        stop = threading.Event()
+        stats = {
+            'received': 0, 'replayed': 0, 'skipped': 0, 'unrouted': 0, 'failed': 0,
+            'receive_errors': 0, 'claimed': 0,
+        }
+        # Set once a receive comes back empty, i.e. the DLQ has been drained
+        drained = threading.Event()
+        # Receipt handles of messages left in the DLQ, released when the run ends
+        unreplayed = []
+
+        def claim() -> int:
+            with lock:
+                if max_messages <= 0:
+                    return MAX_BATCH_SIZE
+                take = min(MAX_BATCH_SIZE, max_messages - stats['claimed'])
+                stats['claimed'] += max(take, 0)
+                return take
+
+        def release(count: int) -> None:
+            with lock:
+                stats['claimed'] -= count
+
+        def worker() -> None:
+            try:
+                drain()
+            except Exception:
+                # Halt the other workers rather than leave them draining unattended
+                stop.set()
+                raise
+
+        def drain() -> None:
+            while not stop.is_set():
+                if self.out_of_time(context):
+                    stop.set()
+                    return
+                take = claim()
+                if take <= 0:
+                    stop.set()
+                    return
+                try:
+                    response = self.sqs_client.receive_message(
+                        QueueUrl=queue_url,
+                        MaxNumberOfMessages=take,
+                        VisibilityTimeout=visibility_timeout,
+                        WaitTimeSeconds=2
+                    )
+                except AWS_ERRORS as e:
+                    logger.error(f"Error receiving from {queue_url}: {str(e)}")
+                    with lock:
+                        stats['receive_errors'] += 1
+                    if max_messages > 0:
+                        release(take)
+                    stop.set()
+                    return
+                messages = response.get('Messages', [])
+                if max_messages > 0:
+                    release(take - len(messages))
+                if not messages:
+                    drained.set()
+                    stop.set()
+                    return
+                process_batch(messages)
+
+        def process_batch(messages: List[Dict[str, Any]]) -> None:
+            parsed = [(message, self.parse_dlq_message(message)) for message in messages]
+            companies = {}
+            if options['company_ids']:
+                photo_ids = [p['detail'].get('photo_id') for _, p in parsed if p and p['detail'].get('photo_id') is not None]
+                companies = self.lookup_photo_companies([int(i) for i in photo_ids])
+                if companies is None:
+                    with lock:
+                        stats['received'] += len(messages)
+                        stats['failed'] += len(messages)
+                        unreplayed.extend(message['ReceiptHandle'] for message in messages)
+                    return
+
+            selected = []
+            left = []
+            skipped = 0
+            unrouted = 0
+            for message, item in parsed:
+                if item is None:
+                    skipped += 1
+                    left.append(message)
+                    continue
+                photo_id = item['detail'].get('photo_id')
+                if (
+                    (options['models'] and item['model'] not in options['models'])
+                    or (options['photo_ids'] and (photo_id is None or int(photo_id) not in options['photo_ids']))
+                    or (options['company_ids'] and companies.get(int(photo_id or 0)) not in options['company_ids'])
+                ):
+                    skipped += 1
+                    left.append(message)
+                    continue
+                if target_queue_url is None and item['detail_type'] not in self.routed_detail_types:
+                    unrouted += 1
+                    left.append(message)
+                    continue
+                selected.append((message, item))
+
+            if target_queue_url is not None:
+                results = self.send_to_queue(
+                    target_queue_url, [message['Body'] for message, _ in selected], limiter, options['dry_run']
+                )
+            else:
+                entries = [self.build_event(item['detail_type'], item['detail']) for _, item in selected]
+                results = self.publish_events(entries, limiter, options['dry_run'])
+
+            replayed = [message for (message, _), ok in zip(selected, results) if ok]
+            failed = [message for (message, _), ok in zip(selected, results) if not ok]
+            if options['dry_run']:
+                left.extend(replayed)
+            elif replayed:
+                try:
+                    self.sqs_client.delete_message_batch(
+                        QueueUrl=queue_url,
+                        Entries=[
+                            {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                            for i, message in enumerate(replayed)
+                        ]
+                    )
+                except AWS_ERRORS as e:
+                    # Already replayed; they reappear after the visibility timeout
+                    logger.error(f"Error deleting {len(replayed)} replayed messages from {queue_url}: {str(e)}")
+
+            with lock:
+                stats['received'] += len(messages)
+                stats['skipped'] += skipped
+                stats['unrouted'] += unrouted
+                stats['replayed'] += len(replayed)
+                stats['failed'] += len(failed)
+                unreplayed.extend(message['ReceiptHandle'] for message in left + failed)
+
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                futures = [executor.submit(worker) for _ in range(options['concurrency'])]
+                for future in futures:
+                    future.result()
+        finally:
+            # Skipped, unrouted, failed and dry-run messages stay hidden while the
+            # run is going so no worker re-reads them; hand them back afterwards
+            self.release_messages(queue_url, unreplayed)
+
+        stats.pop('claimed')
+        # Anything short of an error-free drain (time, max_messages, receive
+        # errors) may have left replayable messages behind; run again
+        stats['complete'] = drained.is_set() and not stats['receive_errors']
+        if stats['unrouted']:
+            logger.error(f"{stats['unrouted']} messages on {queue_url} have no EventBridge rule and were left in place")
+        logger.info(f"DLQ replay from {queue_url} finished: {stats}")
+        return stats
+
+    def backfill(self, options: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        """
+        Publish processing events for a model over existing photos rows.
+
+        The returned next_start_after_id never moves past a row whose publish
+        failed, so a resumed run picks those photos up again.
+        """
+        model = options.get('model')
+        if not model:
+            raise ValueError("model is required for backfill mode")
+        detail_type = f"{model}_processing"
+        if detail_type not in self.routed_detail_types:
+            routed = sorted(t.replace('_processing', '') for t in self.routed_detail_types)
+            raise ValueError(f"No EventBridge rule routes {detail_type}; routed models are {routed}")
+
+        limiter = RateLimiter(options['rate_per_second'])
+        max_messages = options['max_messages']
+        after_id = options['start_after_id']
+        stats = {'published': 0, 'failed': 0}
+        failed_photo_ids = []
+        complete = False
+
+        # Keep each wave of chunks short enough to finish inside the time margin
+        chunks_per_wave = options['concurrency']
+        if options['rate_per_second'] > 0 and not options['dry_run']:
+            budget = options['rate_per_second'] * TIME_MARGIN_MS / 1000 / 2
+            chunks_per_wave = max(1, min(chunks_per_wave, int(budget // MAX_BATCH_SIZE)))
+
+        def publish_chunk(rows: List[Dict[str, Any]]) -> List[bool]:
+            entries = []
+            for row in rows:
+                link = row['photo_s3_link'] or ''
+                bucket = urlparse(link).netloc.split('.s3.')[0] or os.environ.get('BUCKET_NAME')
+                entries.append(self.build_event(detail_type, {
+                    'request_id': str(uuid.uuid4()),
+                    'bucket': bucket,
+                    'photo_id': row['id'],
+                    'timestamp': str(int(time.time())),
+                    'version': '1.0',
+                    'photo_s3_link': link,
+                    'processingType': model
+                }))
+            return self.publish_events(entries, limiter, options['dry_run'])
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            halted = False
+            while not halted:
+                if self.out_of_time(context):
+                    break
+                page_size = options['page_size']
+                if max_messages > 0:
+                    page_size = min(page_size, max_messages - stats['published'] - stats['failed'])
+                    if page_size <= 0:
+                        break
+                try:
+                    rows = self.fetch_photo_page(after_id, page_size, options['company_ids'], options['photo_ids'])
+                except AWS_ERRORS as e:
+                    logger.error(f"Error fetching photos after {after_id}: {str(e)}")
+                    break
+
+                chunks = [rows[i:i + MAX_BATCH_SIZE] for i in range(0, len(rows), MAX_BATCH_SIZE)]
+                for i in range(0, len(chunks), chunks_per_wave):
+                    if self.out_of_time(context):
+                        halted = True
+                        break
+                    wave = chunks[i:i + chunks_per_wave]
+                    for chunk, results in zip(wave, executor.map(publish_chunk, wave)):
+                        for row, ok in zip(chunk, results):
+                            if ok:
+                                stats['published'] += 1
+                                if not failed_photo_ids:
+                                    after_id = row['id']
+                            else:
+                                stats['failed'] += 1
+                                failed_photo_ids.append(row['id'])
+                    if failed_photo_ids:
+                        halted = True
+                        break
+
+                if not halted and len(rows) < page_size:
+                    complete = True
+                    break
+
+        stats['next_start_after_id'] = after_id
+        stats['failed_photo_ids'] = failed_photo_ids
+        stats['complete'] = complete
+        logger.info(f"Backfill of {model} finished: {stats}")
+        return stats
+
+    def handle_replay(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        """Main handler for DLQ replay and backfill runs."""
+        options = self.parse_options(event)
+        logger.info(f"Starting {options['mode']} run with options: {options}")
+        if options['mode'] == 'dlq':
+            result = self.replay_dlq(options, context)
+        elif options['mode'] == 'backfill':
+            result = self.backfill(options, context)
+        else:
+            raise ValueError(f"Unknown mode {options['mode']}")
+        return {'mode': options['mode'], 'dry_run': options['dry_run'], **result}
+
+# Initialize handler
+handler = ReplayHandler()
+
+# Lambda entry point
+def handle_replay(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return handler.handle_replay(event, context)
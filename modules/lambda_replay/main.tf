@@ -0,0 +1,208 @@
+locals {
+  # Normalize tags to lowercase to prevent case-sensitivity issues
+  normalized_tags = merge(
+    {
+      for key, value in var.tags :
+      lower(key) => value
+    },
+    {
+      environment = var.env
+      terraform   = "true"
+    }
+  )
+}
+
+data "archive_file" "lambda_package" {
+  type        = "zip"
+  source_dir  = "${path.module}/functions/dlq_replay"
+  output_path = "${path.module}/dist/dlq_replay.zip"
+}
+
+# Invoked manually (aws lambda invoke) to redrive model DLQs into their
+# queues, replay other DLQs through EventBridge, or backfill a model over
+# existing photos rows
+resource "aws_lambda_function" "dlq_replay" {
+  filename         = data.archive_file.lambda_package.output_path
+  source_code_hash = data.archive_file.lambda_package.output_base64sha256
+  function_name    = "${var.project_name}-${var.env}-dlq-replay"
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "handler.handle_replay"
+  runtime          = var.lambda_runtime
+  memory_size      = var.memory_size
+  timeout          = var.timeout
+
+  vpc_config {
+    subnet_ids         = var.subnet_ids
+    security_group_ids = [aws_security_group.lambda_sg.id]
+  }
+
+  environment {
+    variables = {
+      BUCKET_NAME               = var.s3_bucket_name
+      DB_SECRET_ARN             = var.aurora_secret_arn
+      DB_CLUSTER_ARN            = var.aurora_cluster_arn
+      DB_NAME                   = var.aurora_database_name
+      REPLAY_VISIBILITY_TIMEOUT = var.timeout
+      ROUTED_DETAIL_TYPES       = jsonencode(distinct(values(var.routed_detail_types)))
+      REPLAY_QUEUE_MAP          = jsonencode(var.replay_queue_map)
+    }
+  }
+
+  kms_key_arn = var.kms_key_arn
+
+  tracing_config {
+    mode = "Active"
+  }
+
+  # A single replay at a time so the per-invocation rate limit is the global rate
+  reserved_concurrent_executions = 1
+
+  tags = local.normalized_tags
+}
+
+resource "aws_lambda_function_event_invoke_config" "dlq_replay" {
+  function_name = aws_lambda_function.dlq_replay.function_name
+
+  # Replays are operator driven; never let Lambda re-run one on its own
+  maximum_retry_attempts = 0
+}
+
+resource "aws_security_group" "lambda_sg" {
+  name        = "${var.project_name}-${var.env}-dlq-replay-sg"
+  description = "Security group for DLQ replay Lambda function"
+  vpc_id      = var.vpc_id
+
+  egress {
+    description = "HTTPS outbound traffic"
+    from_port   = 443
+    to_port     = 443
+    protocol    = "tcp"
+    cidr_blocks = ["0.0.0.0/0"]
+  }
+
+  lifecycle {
+    create_before_destroy = true
+  }
+
+  tags = local.normalized_tags
+}
+
+resource "aws_iam_role" "lambda_role" {
+  name = "${var.project_name}-${var.env}-dlq-replay-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      }
+    ]
+  })
+
+  tags = local.normalized_tags
+}
+
+resource "aws_iam_role_policy" "lambda_sqs_policy" {
+  name = "${var.project_name}-${var.env}-dlq-replay-sqs-policy"
+  role = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
+          "sqs:GetQueueAttributes",
+          "sqs:GetQueueUrl"
+        ]
+        Resource = var.dlq_arns
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage"
+        ]
+        Resource = var.replay_queue_arns
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "lambda_eventbridge_policy" {
+  name = "${var.project_name}-${var.env}-dlq-replay-eventbridge-policy"
+  role = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "events:PutEvents"
+        ]
+        Resource = "*"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "lambda_rds_policy" {
+  name = "${var.project_name}-${var.env}-dlq-replay-rds-policy"
+  role = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "rds-data:ExecuteStatement"
+        ]
+        Resource = var.aurora_cluster_arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "secretsmanager:GetSecretValue"
+        ]
+        Resource = var.aurora_secret_arn
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "lambda_basic" {
+  role       = aws_iam_role.lambda_role.name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
+}
+
+resource "aws_iam_role_policy_attachment" "lambda_vpc_access" {
+  role       = aws_iam_role.lambda_role.name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole"
+}
+
+resource "aws_iam_role_policy" "lambda_kms_policy" {
+  name = "${var.project_name}-${var.env}-dlq-replay-kms-policy"
+  role = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "kms:Decrypt",
+          "kms:DescribeKey"
+        ]
+        Resource = [var.kms_key_arn, var.aurora_kms_key_arn]
+      }
+    ]
+  })
+}
@@ -0,0 +1,21 @@
+# lambda_replay/outputs.tf
+
+output "function_arn" {
+  description = "ARN of the DLQ replay Lambda function"
+  value       = aws_lambda_function.dlq_replay.arn
+}
+
+output "function_name" {
+  description = "Name of the DLQ replay Lambda function"
+  value       = aws_lambda_function.dlq_replay.function_name
+}
+
+output "role_arn" {
+  description = "ARN of the DLQ replay Lambda IAM role"
+  value       = aws_iam_role.lambda_role.arn
+}
+
+output "security_group_id" {
+  description = "ID of the DLQ replay Lambda security group"
+  value       = aws_security_group.lambda_sg.id
+}
@@ -0,0 +1,95 @@
+# lambda_replay/variables.tf
+
+variable "project_name" {
+  description = "Name of the project"
+  type        = string
+}
+
+variable "env" {
+  description = "Environment name"
+  type        = string
+}
+
+variable "s3_bucket_name" {
+  description = "Name of the S3 upload bucket, used when a photo link has no bucket"
+  type        = string
+}
+
+variable "memory_size" {
+  description = "Memory size for Lambda function"
+  type        = number
+  default     = 256
+}
+
+variable "timeout" {
+  description = "Timeout for Lambda function; a run stops picking up work shortly before it"
+  type        = number
+  default     = 900
+}
+
+variable "lambda_runtime" {
+  description = "Runtime for Lambda function"
+  type        = string
+  default     = "python3.9"
+}
+
+variable "kms_key_arn" {
+  description = "ARN of the KMS key for encryption"
+  type        = string
+}
+
+variable "subnet_ids" {
+  description = "List of subnet IDs for Lambda VPC config"
+  type        = list(string)
+}
+
+variable "vpc_id" {
+  description = "ID of the VPC"
+  type        = string
+}
+
+variable "dlq_arns" {
+  description = "ARNs of the dead-letter queues the replay function may drain"
+  type        = list(string)
+}
+
+variable "replay_queue_map" {
+  description = "Map of model DLQ URLs to the URL of the queue each one drains; these DLQs are redriven straight into that queue"
+  type        = map(string)
+}
+
+variable "replay_queue_arns" {
+  description = "ARNs of the queues listed in replay_queue_map, which the replay function may send to"
+  type        = list(string)
+}
+
+variable "routed_detail_types" {
+  description = "Map of EventBridge rule names to the detail-type each routes; other detail-types are never replayed through EventBridge"
+  type        = map(string)
+}
+
+variable "tags" {
+  description = "A map of tags to add to all resources"
+  type        = map(string)
+  default     = {}
+}
+
+variable "aurora_cluster_arn" {
+  description = "ARN of the Aurora Serverless cluster"
+  type        = string
+}
+
+variable "aurora_secret_arn" {
+  description = "ARN of the Aurora Serverless secret in Secrets Manager"
+  type        = string
+}
+
+variable "aurora_database_name" {
+  description = "Name of the Aurora database"
+  type        = string
+}
+
+variable "aurora_kms_key_arn" {
+  description = "ARN of the KMS key used for Aurora encryption"
+  type        = string
+}